@@ -0,0 +1,370 @@
+/*
+ * _aesni_cbc.c
+ *
+ * AES-128 in CBC mode on top of the AES-NI instructions.
+ *
+ * CBC decryption has no dependency between blocks until the final XOR with
+ * the previous ciphertext block, so blocks are decrypted PIPELINE at a time
+ * with their aesdec rounds interleaved. This hides the latency of aesdec
+ * behind its throughput. CBC encryption is serial within a message, so
+ * cbc_encrypt_many() interleaves up to PIPELINE independent messages instead,
+ * sharing a single key expansion.
+ *
+ * The AES-NI code paths are compiled with a target attribute rather than
+ * global -maes flags, so the module loads on any x86 CPU. Callers check
+ * has_aesni() (done once by charm.toolbox.cpu.aesni_extension()) before
+ * using the cipher functions.
+ */
+
+#include <Python.h>
+#include <stdint.h>
+#include <string.h>
+
+#define BLOCK_SIZE 16
+#define KEY_SIZE 16
+#define ROUNDS 10
+#define PIPELINE 8
+
+#if (defined(__GNUC__) || defined(__clang__)) && (defined(__x86_64__) || defined(__i386__))
+#define HAVE_AESNI_BUILD 1
+#include <emmintrin.h>
+#include <wmmintrin.h>
+#define AESNI_TARGET __attribute__((target("aes,sse2")))
+#endif
+
+static void secure_zero(void *p, size_t len)
+{
+	volatile uint8_t *v = (volatile uint8_t *) p;
+	while (len--)
+		*v++ = 0;
+}
+
+typedef struct {
+	const uint8_t *iv;
+	const uint8_t *in;
+	uint8_t *out;
+	size_t nblocks;
+} cbc_stream;
+
+#ifdef HAVE_AESNI_BUILD
+
+static AESNI_TARGET __m128i expand_step(__m128i key, __m128i keygened)
+{
+	keygened = _mm_shuffle_epi32(keygened, _MM_SHUFFLE(3, 3, 3, 3));
+	key = _mm_xor_si128(key, _mm_slli_si128(key, 4));
+	key = _mm_xor_si128(key, _mm_slli_si128(key, 4));
+	key = _mm_xor_si128(key, _mm_slli_si128(key, 4));
+	return _mm_xor_si128(key, keygened);
+}
+
+/* aeskeygenassist takes the round constant as an immediate */
+#define EXPAND(k, rcon) expand_step(k, _mm_aeskeygenassist_si128(k, rcon))
+
+static AESNI_TARGET void aes128_expand_enc_key(const uint8_t *key, __m128i ek[ROUNDS + 1])
+{
+	ek[0] = _mm_loadu_si128((const __m128i *) key);
+	ek[1] = EXPAND(ek[0], 0x01);
+	ek[2] = EXPAND(ek[1], 0x02);
+	ek[3] = EXPAND(ek[2], 0x04);
+	ek[4] = EXPAND(ek[3], 0x08);
+	ek[5] = EXPAND(ek[4], 0x10);
+	ek[6] = EXPAND(ek[5], 0x20);
+	ek[7] = EXPAND(ek[6], 0x40);
+	ek[8] = EXPAND(ek[7], 0x80);
+	ek[9] = EXPAND(ek[8], 0x1b);
+	ek[10] = EXPAND(ek[9], 0x36);
+}
+
+static AESNI_TARGET void aes128_expand_dec_key(const uint8_t *key, __m128i dk[ROUNDS + 1])
+{
+	__m128i ek[ROUNDS + 1];
+	int i;
+
+	aes128_expand_enc_key(key, ek);
+	/* equivalent inverse cipher: reversed schedule, InvMixColumns on the inner keys */
+	dk[0] = ek[ROUNDS];
+	for (i = 1; i < ROUNDS; i++)
+		dk[i] = _mm_aesimc_si128(ek[ROUNDS - i]);
+	dk[ROUNDS] = ek[0];
+	secure_zero(ek, sizeof(ek));
+}
+
+static AESNI_TARGET void aes128_cbc_decrypt(const __m128i dk[ROUNDS + 1], const uint8_t *iv,
+		const uint8_t *in, uint8_t *out, size_t nblocks)
+{
+	__m128i prev = _mm_loadu_si128((const __m128i *) iv);
+	__m128i c[PIPELINE], b[PIPELINE];
+	size_t i = 0;
+	int j, r;
+
+	for (; i + PIPELINE <= nblocks; i += PIPELINE) {
+		for (j = 0; j < PIPELINE; j++) {
+			c[j] = _mm_loadu_si128((const __m128i *) (in + (i + j) * BLOCK_SIZE));
+			b[j] = _mm_xor_si128(c[j], dk[0]);
+		}
+		for (r = 1; r < ROUNDS; r++) {
+			for (j = 0; j < PIPELINE; j++)
+				b[j] = _mm_aesdec_si128(b[j], dk[r]);
+		}
+		for (j = 0; j < PIPELINE; j++)
+			b[j] = _mm_aesdeclast_si128(b[j], dk[ROUNDS]);
+
+		b[0] = _mm_xor_si128(b[0], prev);
+		for (j = 1; j < PIPELINE; j++)
+			b[j] = _mm_xor_si128(b[j], c[j - 1]);
+		for (j = 0; j < PIPELINE; j++)
+			_mm_storeu_si128((__m128i *) (out + (i + j) * BLOCK_SIZE), b[j]);
+		prev = c[PIPELINE - 1];
+	}
+
+	for (; i < nblocks; i++) {
+		c[0] = _mm_loadu_si128((const __m128i *) (in + i * BLOCK_SIZE));
+		b[0] = _mm_xor_si128(c[0], dk[0]);
+		for (r = 1; r < ROUNDS; r++)
+			b[0] = _mm_aesdec_si128(b[0], dk[r]);
+		b[0] = _mm_aesdeclast_si128(b[0], dk[ROUNDS]);
+		_mm_storeu_si128((__m128i *) (out + i * BLOCK_SIZE), _mm_xor_si128(b[0], prev));
+		prev = c[0];
+	}
+}
+
+/* encrypts up to PIPELINE independent CBC streams, interleaving their rounds */
+static AESNI_TARGET void aes128_cbc_encrypt_streams(const __m128i ek[ROUNDS + 1],
+		const cbc_stream *s, int n)
+{
+	__m128i b[PIPELINE];
+	int lane[PIPELINE];
+	size_t k, maxblocks = 0;
+	int j, m, r, t;
+
+	for (j = 0; j < n; j++) {
+		b[j] = _mm_loadu_si128((const __m128i *) s[j].iv);
+		if (s[j].nblocks > maxblocks)
+			maxblocks = s[j].nblocks;
+	}
+
+	for (k = 0; k < maxblocks; k++) {
+		for (j = 0, m = 0; j < n; j++) {
+			if (k < s[j].nblocks)
+				lane[m++] = j;
+		}
+		for (t = 0; t < m; t++) {
+			j = lane[t];
+			b[j] = _mm_xor_si128(b[j], _mm_loadu_si128((const __m128i *) (s[j].in + k * BLOCK_SIZE)));
+			b[j] = _mm_xor_si128(b[j], ek[0]);
+		}
+		for (r = 1; r < ROUNDS; r++) {
+			for (t = 0; t < m; t++)
+				b[lane[t]] = _mm_aesenc_si128(b[lane[t]], ek[r]);
+		}
+		for (t = 0; t < m; t++) {
+			j = lane[t];
+			b[j] = _mm_aesenclast_si128(b[j], ek[ROUNDS]);
+			_mm_storeu_si128((__m128i *) (s[j].out + k * BLOCK_SIZE), b[j]);
+		}
+	}
+}
+
+static int cpu_has_aesni(void)
+{
+	__builtin_cpu_init();
+	return __builtin_cpu_supports("aes") && __builtin_cpu_supports("sse2");
+}
+
+#else
+
+static int cpu_has_aesni(void)
+{
+	return 0;
+}
+
+#endif /* HAVE_AESNI_BUILD */
+
+static int check_buffers(Py_buffer *key, Py_buffer *iv)
+{
+	if (key->len != KEY_SIZE) {
+		PyErr_Format(PyExc_ValueError, "key must be %d bytes long", KEY_SIZE);
+		return -1;
+	}
+	if (iv->len != BLOCK_SIZE) {
+		PyErr_Format(PyExc_ValueError, "IV must be %d bytes long", BLOCK_SIZE);
+		return -1;
+	}
+	if (!cpu_has_aesni()) {
+		PyErr_SetString(PyExc_RuntimeError, "AES-NI is not supported on this CPU");
+		return -1;
+	}
+	return 0;
+}
+
+PyDoc_STRVAR(has_aesni__doc__,
+"has_aesni() -> bool\n\nTrue if the CPU and this build support the AES-NI code paths.");
+
+static PyObject *has_aesni(PyObject *self, PyObject *args)
+{
+	return PyBool_FromLong(cpu_has_aesni());
+}
+
+PyDoc_STRVAR(cbc_decrypt__doc__,
+"cbc_decrypt(key, iv, ciphertext) -> bytes\n\n"
+"Decrypts ciphertext with AES-128-CBC. No padding is removed.");
+
+static PyObject *cbc_decrypt(PyObject *self, PyObject *args)
+{
+	Py_buffer key, iv, ct;
+	PyObject *result = NULL;
+
+	if (!PyArg_ParseTuple(args, "y*y*y*:cbc_decrypt", &key, &iv, &ct))
+		return NULL;
+	if (check_buffers(&key, &iv) < 0)
+		goto done;
+	if (ct.len % BLOCK_SIZE != 0) {
+		PyErr_Format(PyExc_ValueError, "ciphertext length must be a multiple of %d", BLOCK_SIZE);
+		goto done;
+	}
+
+	result = PyBytes_FromStringAndSize(NULL, ct.len);
+	if (result == NULL)
+		goto done;
+
+#ifdef HAVE_AESNI_BUILD
+	{
+		__m128i dk[ROUNDS + 1];
+		uint8_t *out = (uint8_t *) PyBytes_AS_STRING(result);
+
+		Py_BEGIN_ALLOW_THREADS
+		aes128_expand_dec_key((const uint8_t *) key.buf, dk);
+		aes128_cbc_decrypt(dk, (const uint8_t *) iv.buf, (const uint8_t *) ct.buf,
+				out, ct.len / BLOCK_SIZE);
+		secure_zero(dk, sizeof(dk));
+		Py_END_ALLOW_THREADS
+	}
+#endif
+
+done:
+	PyBuffer_Release(&key);
+	PyBuffer_Release(&iv);
+	PyBuffer_Release(&ct);
+	return result;
+}
+
+PyDoc_STRVAR(cbc_encrypt_many__doc__,
+"cbc_encrypt_many(key, ivs, plaintexts) -> list of bytes\n\n"
+"Encrypts each plaintext with AES-128-CBC under its own IV, expanding the key\n"
+"once. Plaintexts must already be padded to a multiple of the block size.");
+
+static PyObject *cbc_encrypt_many(PyObject *self, PyObject *args)
+{
+	Py_buffer key;
+	PyObject *ivs_arg, *pts_arg, *ivs = NULL, *pts = NULL, *result = NULL;
+	Py_buffer *bufs = NULL;
+	cbc_stream *streams = NULL;
+	Py_ssize_t n = 0, acquired = 0, i;
+
+	if (!PyArg_ParseTuple(args, "y*OO:cbc_encrypt_many", &key, &ivs_arg, &pts_arg))
+		return NULL;
+	if (key.len != KEY_SIZE) {
+		PyErr_Format(PyExc_ValueError, "key must be %d bytes long", KEY_SIZE);
+		goto done;
+	}
+	if (!cpu_has_aesni()) {
+		PyErr_SetString(PyExc_RuntimeError, "AES-NI is not supported on this CPU");
+		goto done;
+	}
+	ivs = PySequence_Fast(ivs_arg, "ivs must be a sequence");
+	pts = PySequence_Fast(pts_arg, "plaintexts must be a sequence");
+	if (ivs == NULL || pts == NULL)
+		goto done;
+	n = PySequence_Fast_GET_SIZE(pts);
+	if (PySequence_Fast_GET_SIZE(ivs) != n) {
+		PyErr_SetString(PyExc_ValueError, "expected one IV per plaintext");
+		goto done;
+	}
+
+	bufs = PyMem_New(Py_buffer, 2 * n + 1);
+	streams = PyMem_New(cbc_stream, n + 1);
+	result = PyList_New(n);
+	if (bufs == NULL || streams == NULL || result == NULL) {
+		if (!PyErr_Occurred())
+			PyErr_NoMemory();
+		goto error;
+	}
+
+	for (i = 0; i < n; i++) {
+		PyObject *out;
+
+		if (PyObject_GetBuffer(PySequence_Fast_GET_ITEM(ivs, i), &bufs[acquired], PyBUF_SIMPLE) < 0)
+			goto error;
+		acquired++;
+		if (PyObject_GetBuffer(PySequence_Fast_GET_ITEM(pts, i), &bufs[acquired], PyBUF_SIMPLE) < 0)
+			goto error;
+		acquired++;
+		if (bufs[2 * i].len != BLOCK_SIZE) {
+			PyErr_Format(PyExc_ValueError, "IV must be %d bytes long", BLOCK_SIZE);
+			goto error;
+		}
+		if (bufs[2 * i + 1].len % BLOCK_SIZE != 0) {
+			PyErr_Format(PyExc_ValueError, "plaintext length must be a multiple of %d", BLOCK_SIZE);
+			goto error;
+		}
+		out = PyBytes_FromStringAndSize(NULL, bufs[2 * i + 1].len);
+		if (out == NULL)
+			goto error;
+		PyList_SET_ITEM(result, i, out);
+		streams[i].iv = (const uint8_t *) bufs[2 * i].buf;
+		streams[i].in = (const uint8_t *) bufs[2 * i + 1].buf;
+		streams[i].out = (uint8_t *) PyBytes_AS_STRING(out);
+		streams[i].nblocks = bufs[2 * i + 1].len / BLOCK_SIZE;
+	}
+
+#ifdef HAVE_AESNI_BUILD
+	{
+		__m128i ek[ROUNDS + 1];
+
+		Py_BEGIN_ALLOW_THREADS
+		aes128_expand_enc_key((const uint8_t *) key.buf, ek);
+		for (i = 0; i < n; i += PIPELINE)
+			aes128_cbc_encrypt_streams(ek, streams + i, (int) (n - i < PIPELINE ? n - i : PIPELINE));
+		secure_zero(ek, sizeof(ek));
+		Py_END_ALLOW_THREADS
+	}
+#endif
+	goto done;
+
+error:
+	Py_CLEAR(result);
+done:
+	for (i = 0; i < acquired; i++)
+		PyBuffer_Release(&bufs[i]);
+	PyMem_Free(bufs);
+	PyMem_Free(streams);
+	Py_XDECREF(ivs);
+	Py_XDECREF(pts);
+	PyBuffer_Release(&key);
+	return result;
+}
+
+static PyMethodDef module_methods[] = {
+	{"has_aesni", (PyCFunction) has_aesni, METH_NOARGS, has_aesni__doc__},
+	{"cbc_decrypt", (PyCFunction) cbc_decrypt, METH_VARARGS, cbc_decrypt__doc__},
+	{"cbc_encrypt_many", (PyCFunction) cbc_encrypt_many, METH_VARARGS, cbc_encrypt_many__doc__},
+	{NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef moduledef = {
+	PyModuleDef_HEAD_INIT,
+	"_aesni_cbc",
+	"AES-128-CBC using the AES-NI instructions.",
+	-1,
+	module_methods,
+	NULL,
+	NULL,
+	NULL,
+	NULL
+};
+
+PyMODINIT_FUNC
+PyInit__aesni_cbc(void)
+{
+	return PyModule_Create(&moduledef);
+}
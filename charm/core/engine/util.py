@@ -27,6 +27,9 @@ def serializeObject(Objects, group):
 
     if type(Objects) == dict: 
        return serializeDict(Objects, group)
+    elif isinstance(Objects, tuple) and hasattr(Objects, '_asdict'):
+        # named tuples, e.g. symcrypto.AuthMsg, serialize as dicts
+        return serializeDict(dict(Objects._asdict()), group)
     elif type(Objects) in [list,tuple]:
         return serializeList(Objects, group)
     elif type(Objects) == str:
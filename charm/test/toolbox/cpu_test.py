@@ -0,0 +1,95 @@
+import unittest
+import sys
+import types
+from unittest import mock
+from charm.toolbox import cpu
+
+class HasAESNITest(unittest.TestCase):
+
+    def setUp(self):
+        # both answers are cached at module level, start every test from scratch
+        self._cached = (cpu._aesni, cpu._aesni_extension)
+        cpu._aesni = cpu._aesni_extension = cpu._unknown
+
+    def tearDown(self):
+        cpu._aesni, cpu._aesni_extension = self._cached
+
+    def replaceExtension(self, module):
+        # module None makes the import fail, as for builds without the extension
+        import charm.core.crypto as crypto
+        missing = object()
+        previous = getattr(crypto, '_aesni_cbc', missing)
+        if hasattr(crypto, '_aesni_cbc'):
+            del crypto._aesni_cbc
+        if module is not None:
+            crypto._aesni_cbc = module
+        def restore():
+            if hasattr(crypto, '_aesni_cbc'):
+                del crypto._aesni_cbc
+            if previous is not missing:
+                crypto._aesni_cbc = previous
+        self.addCleanup(restore)
+        patcher = mock.patch.dict(sys.modules, {'charm.core.crypto._aesni_cbc': module})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def testExtension(self):
+        extension = object()
+        with mock.patch.object(cpu, 'aesni_extension', return_value=extension), \
+             mock.patch.object(cpu, '_cpuinfo_has_aesni', return_value=False) as cpuinfo:
+            assert cpu.has_aesni(), "expected a usable extension to imply AES-NI"
+            assert not cpuinfo.called, "expected the extension to be trusted without scanning cpuinfo"
+
+    def testCached(self):
+        with mock.patch.object(cpu, 'aesni_extension', return_value=None) as extension, \
+             mock.patch.object(cpu, '_cpuinfo_has_aesni', return_value=True) as cpuinfo:
+            assert cpu.has_aesni()
+            cpuinfo.return_value = False
+            assert cpu.has_aesni(), "expected the first answer to be cached"
+            assert extension.call_count == cpuinfo.call_count == 1
+
+    def testUnusableExtension(self):
+        # built without the AES-NI code paths, or on a CPU without AES-NI
+        extension = types.ModuleType('charm.core.crypto._aesni_cbc')
+        extension.has_aesni = lambda: False
+        self.replaceExtension(extension)
+        assert cpu.aesni_extension() is None, "expected an unusable extension to be ignored"
+        with mock.patch.object(cpu, '_cpuinfo_has_aesni', return_value=True):
+            assert cpu.has_aesni(), "expected the cpuinfo scan when the extension is unusable"
+
+    def testMissingExtension(self):
+        self.replaceExtension(None)
+        assert cpu.aesni_extension() is None
+        with mock.patch.object(cpu, '_cpuinfo_has_aesni', return_value=False):
+            assert not cpu.has_aesni()
+
+    def testUsableExtension(self):
+        extension = types.ModuleType('charm.core.crypto._aesni_cbc')
+        extension.has_aesni = lambda: True
+        self.replaceExtension(extension)
+        assert cpu.aesni_extension() is extension
+        assert cpu.has_aesni()
+
+class CPUInfoTest(unittest.TestCase):
+
+    def cpuinfo(self, contents, machine='x86_64'):
+        with mock.patch('platform.machine', return_value=machine), \
+             mock.patch('builtins.open', mock.mock_open(read_data=contents)):
+            return cpu._cpuinfo_has_aesni()
+
+    def testFlags(self):
+        assert self.cpuinfo("processor\t: 0\nflags\t\t: fpu sse2 aes avx\n")
+        assert not self.cpuinfo("processor\t: 0\nflags\t\t: fpu sse2 avx\n")
+        # only whole flags count
+        assert not self.cpuinfo("flags\t\t: fpu vaes_like\n")
+
+    def testNotX86(self):
+        assert not self.cpuinfo("flags\t\t: fpu sse2 aes avx\n", machine='aarch64')
+
+    def testUnreadable(self):
+        with mock.patch('platform.machine', return_value='x86_64'), \
+             mock.patch('builtins.open', side_effect=IOError):
+            assert not cpu._cpuinfo_has_aesni()
+
+if __name__ == "__main__":
+    unittest.main()
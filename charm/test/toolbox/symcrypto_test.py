@@ -1,7 +1,17 @@
 import unittest 
-from charm.toolbox.symcrypto import SymmetricCryptoAbstraction,AuthenticatedCryptoAbstraction, MessageAuthenticator
+from array import array
+from charm.toolbox.symcrypto import SymmetricCryptoAbstraction,AuthenticatedCryptoAbstraction, MessageAuthenticator, _AEADCipherAbstraction, AESGCMCryptoAbstraction, ChaCha20Poly1305CryptoAbstraction, selectAEAD, _pkcs7_unpad
 from charm.toolbox.pairinggroup import PairingGroup,GT
 from charm.core.math.pairing import hashPair as sha2
+from charm.toolbox.bitstring import Bytes
+from charm.toolbox import cpu
+from charm.core.engine.util import objectToBytes, bytesToObject
+try:
+    import Crypto.Cipher.AES
+    pycryptodome_available = True
+except ImportError:
+    pycryptodome_available = False
+
 class SymmetricCryptoAbstractionTest(unittest.TestCase):
     
     def testAESCBC(self):
@@ -33,6 +43,76 @@ class SymmetricCryptoAbstractionTest(unittest.TestCase):
         dmsg = b.decrypt(ct);
         assert msg == dmsg , 'o: =>%s\nm: =>%s' % (msg, dmsg)
 
+    def testAESCBCBinaryEnvelope(self):
+        msg = b"hello world"
+        groupObj = PairingGroup('SS512')
+        a =  SymmetricCryptoAbstraction(sha2(groupObj.random(GT)), legacy=False)
+        ct = a.encrypt(msg)
+        assert type(ct) == bytes, "expected a binary envelope"
+        dmsg = a.decrypt(ct)
+        assert msg == dmsg , 'o: =>%s\nm: =>%s' % (msg, dmsg)
+        self.assertRaises(ValueError, a.decrypt, ct[:-1])
+
+    def testAESCBCDecryptBackends(self):
+        msg = b"Lots of people working in cryptography have no deep concern with real application issues." * 4
+        key = sha2(PairingGroup('SS512').random(GT))
+        a =  SymmetricCryptoAbstraction(key)
+        if a._cbcDecrypt is None:
+            self.skipTest("AES-NI CBC decryption is not available")
+        ct = a.encrypt(msg)
+        b =  SymmetricCryptoAbstraction(key)
+        b._cbcDecrypt = None
+        assert a.decrypt(ct) == b.decrypt(ct) == msg, "AES-NI and generic CBC decryption disagree"
+
+    def testAESCBCEncryptMany(self):
+        msgs = [b"", b"hello world", b"x" * 16, b"y" * 200] * 3
+        key = sha2(PairingGroup('SS512').random(GT))
+        for legacy in (True, False):
+            a =  SymmetricCryptoAbstraction(key, legacy=legacy)
+            cts = a.encrypt_many(msgs)
+            assert len(cts) == len(msgs)
+            b =  SymmetricCryptoAbstraction(key, legacy=legacy)
+            assert [b.decrypt(ct) for ct in cts] == msgs, "encrypt_many round trip failed"
+
+    def testAESCBCDecryptBytesSubclass(self):
+        msg = b"hello world"
+        a =  SymmetricCryptoAbstraction(sha2(PairingGroup('SS512').random(GT)))
+        ct = Bytes(a.encrypt(msg), 'utf-8')
+        dmsg = a.decrypt(ct)
+        assert msg == dmsg , 'o: =>%s\nm: =>%s' % (msg, dmsg)
+
+    def testPKCS7Unpad(self):
+        for n in range(1, 17):
+            msg = b"x" * 20
+            assert _pkcs7_unpad(msg + bytes([n]) * n) == msg, "expected %d bytes of padding to be stripped" % n
+        invalid = [b"x" * 31 + b"\x00",               # pad byte 0
+                   b"x" * 31 + b"\x11",               # pad byte > 16
+                   b"x" * 28 + b"\x04\x05\x04\x04",   # wrong byte inside the pad
+                   b"\x04" * 4,                       # shorter than a block
+                   b""]
+        for msg in invalid:
+            assert _pkcs7_unpad(msg) == msg, "expected invalid padding to be left in place: %r" % msg
+
+    def testPKCS7PadRoundTrip(self):
+        key = sha2(PairingGroup('SS512').random(GT))
+        a =  SymmetricCryptoAbstraction(key)
+        for length in range(34):
+            msg = b"x" * length
+            ct = a._encrypt(msg)['CipherText']
+            assert len(ct) % 16 == 0 and len(ct) > length, "expected padding up to the next block"
+            assert a.decrypt(a.encrypt(msg)) == msg, "round trip failed for %d bytes" % length
+
+    def testBufferInputs(self):
+        # items wider than a byte: len() is 3, the payload is 12 bytes
+        wide = memoryview(array('i', [1, 2, 3]))
+        key = sha2(PairingGroup('SS512').random(GT))
+        for legacy in (True, False):
+            a =  SymmetricCryptoAbstraction(key, legacy=legacy)
+            assert a.decrypt(a.encrypt(wide)) == wide.tobytes(), "expected a wide buffer to encrypt as its bytes"
+            msgs = [wide, bytearray(b'hello world'), memoryview(b'x' * 16)]
+            cts = a.encrypt_many(msgs)
+            assert [a.decrypt(ct) for ct in cts] == [bytes(memoryview(m).cast('B')) for m in msgs], "encrypt_many round trip failed"
+
 class AuthenticatedCryptoAbstractionTest(unittest.TestCase):
     
     def testAESCBC(self):
@@ -64,6 +144,126 @@ class AuthenticatedCryptoAbstractionTest(unittest.TestCase):
         dmsg = b.decrypt(ct);
         assert msg == dmsg , 'o: =>%s\nm: =>%s' % (msg, dmsg)
 
+    def testAESCBCBinaryEnvelope(self):
+        msg = b"hello world"
+        groupObj = PairingGroup('SS512')
+        a =  AuthenticatedCryptoAbstraction(sha2(groupObj.random(GT)), legacy=False)
+        ct = a.encrypt(msg, associatedData=b'header')
+        dmsg = a.decrypt(ct, associatedData=b'header')
+        assert msg == dmsg , 'o: =>%s\nm: =>%s' % (msg, dmsg)
+
+    def testAESCBCEncryptMany(self):
+        msgs = [b"", b"hello world", b"y" * 200] * 3
+        key = sha2(PairingGroup('SS512').random(GT))
+        for legacy in (True, False):
+            a =  AuthenticatedCryptoAbstraction(key, legacy=legacy)
+            cts = a.encrypt_many(msgs, associatedData=b'header')
+            b =  AuthenticatedCryptoAbstraction(key, legacy=legacy)
+            assert [b.decrypt(ct, associatedData=b'header') for ct in cts] == msgs, "encrypt_many round trip failed"
+            self.assertRaises(ValueError, b.decrypt, cts[0])
+            if a._cbcEncryptMany is not None:
+                # the generic path must produce the same envelopes
+                a._cbcEncryptMany = None
+                cts = a.encrypt_many(msgs, associatedData=b'header')
+                assert [b.decrypt(ct, associatedData=b'header') for ct in cts] == msgs, "encrypt_many round trip failed"
+
+    def testSerializeCiphertext(self):
+        groupObj = PairingGroup('SS512')
+        key = sha2(groupObj.random(GT))
+        for legacy in (True, False):
+            a =  AuthenticatedCryptoAbstraction(key, legacy=legacy)
+            ct = bytesToObject(objectToBytes(a.encrypt(b"hello world"), groupObj), groupObj)
+            assert a.decrypt(ct) == b"hello world", "expected the ciphertext to survive serialization"
+
+    def testBufferInputs(self):
+        key = sha2(PairingGroup('SS512').random(GT))
+        wide = memoryview(array('i', [1, 2, 3]))
+        for legacy in (True, False):
+            c = AuthenticatedCryptoAbstraction(key, legacy=legacy)
+            ct = c.encrypt(memoryview(b'hello world'), associatedData=bytearray(b'header'))
+            assert c.decrypt(ct, associatedData=b'header') == b'hello world'
+            ct = c.encrypt(wide, associatedData=memoryview(b'header'))
+            assert c.decrypt(ct, associatedData='header') == wide.tobytes(), "expected a wide buffer to encrypt as its bytes"
+
+@unittest.skipUnless(pycryptodome_available, "PyCryptodome is not installed")
+class AESGCMCryptoAbstractionTest(unittest.TestCase):
+
+    def testAESGCM(self):
+        msg = b"hello world"
+        a =  AESGCMCryptoAbstraction(sha2(PairingGroup('SS512').random(GT)))
+        ct = a.encrypt(msg, associatedData=b'header')
+        dmsg = a.decrypt(ct, associatedData=b'header')
+        assert msg == dmsg , 'o: =>%s\nm: =>%s' % (msg, dmsg)
+
+    def testAESGCMStrMessage(self):
+        cipher = AESGCMCryptoAbstraction(sha2(PairingGroup('SS512').random(GT)))
+        ciphertext = cipher.encrypt('Some network PDU.', associatedData=b'\x10\x11\x11\x11')
+        assert cipher.decrypt(ciphertext, associatedData=b'\x10\x11\x11\x11') == b'Some network PDU.'
+        self.assertRaises(ValueError, cipher.decrypt, ciphertext)
+
+    def testAESGCMTamper(self):
+        a =  AESGCMCryptoAbstraction(sha2(PairingGroup('SS512').random(GT)))
+        ct = a.encrypt(b"hello world", associatedData=b'header')
+        tampered = ct[:-1] + bytes([ct[-1] ^ 1])
+        self.assertRaises(ValueError, a.decrypt, tampered, associatedData=b'header')
+        self.assertRaises(ValueError, a.decrypt, ct, associatedData=b'wrong header')
+        self.assertRaises(ValueError, a.decrypt, ct[:20])
+
+    def testAEADBaseClass(self):
+        self.assertRaises(TypeError, _AEADCipherAbstraction, sha2(PairingGroup('SS512').random(GT)))
+
+    def testAESGCMBufferInputs(self):
+        wide = memoryview(array('i', [1, 2, 3]))
+        a =  AESGCMCryptoAbstraction(sha2(PairingGroup('SS512').random(GT)))
+        ct = a.encrypt(wide, associatedData=bytearray(b'header'))
+        assert a.decrypt(ct, associatedData=memoryview(b'header')) == wide.tobytes(), "expected a wide buffer to encrypt as its bytes"
+
+@unittest.skipUnless(pycryptodome_available, "PyCryptodome is not installed")
+class ChaCha20Poly1305CryptoAbstractionTest(unittest.TestCase):
+
+    def testChaCha20Poly1305(self):
+        msg = b"hello world"
+        a =  ChaCha20Poly1305CryptoAbstraction(sha2(PairingGroup('SS512').random(GT)))
+        ct = a.encrypt(msg, associatedData=b'header')
+        dmsg = a.decrypt(ct, associatedData=b'header')
+        assert msg == dmsg , 'o: =>%s\nm: =>%s' % (msg, dmsg)
+        self.assertRaises(ValueError, a.decrypt, ct, associatedData=b'wrong header')
+
+@unittest.skipUnless(pycryptodome_available, "PyCryptodome is not installed")
+class SelectAEADTest(unittest.TestCase):
+
+    def testSelectAEAD(self):
+        msg = b"hello world"
+        key = sha2(PairingGroup('SS512').random(GT))
+        ct = selectAEAD(key).encrypt(msg)
+        dmsg = selectAEAD(key).decrypt(ct)
+        assert msg == dmsg , 'o: =>%s\nm: =>%s' % (msg, dmsg)
+
+    def testSelectAEADDecryptsEitherCipher(self):
+        msg = b"hello world"
+        key = sha2(PairingGroup('SS512').random(GT))
+        aesni = cpu._aesni
+        try:
+            # encrypt as a host with and as a host without AES-NI would
+            cts = []
+            for flag in (True, False):
+                cpu._aesni = flag
+                cts.append(selectAEAD(key).encrypt(msg, associatedData=b'header'))
+        finally:
+            cpu._aesni = aesni
+        assert [ct[:1] for ct in cts] == [AESGCMCryptoAbstraction._alg_id, ChaCha20Poly1305CryptoAbstraction._alg_id]
+        for ct in cts:
+            dmsg = selectAEAD(key).decrypt(ct, associatedData=b'header')
+            assert msg == dmsg , 'o: =>%s\nm: =>%s' % (msg, dmsg)
+        # each cipher is keyed with its own subkey, not with the raw key
+        self.assertRaises(ValueError, AESGCMCryptoAbstraction(key).decrypt, cts[0], associatedData=b'header')
+        self.assertRaises(ValueError, ChaCha20Poly1305CryptoAbstraction(key).decrypt, cts[0], associatedData=b'header')
+        self.assertRaises(ValueError, selectAEAD(key).decrypt, b'\xff' + cts[0][1:])
+
+    def testSelectAEADShortKey(self):
+        key = sha2(PairingGroup('SS512').random(GT))[:16]
+        self.assertRaises(ValueError, selectAEAD, key)
+
 class MessageAuthenticatorTest(unittest.TestCase):
     def testSelfVerify(self):
         key = sha2(PairingGroup('SS512').random(GT))
@@ -78,12 +278,26 @@ class MessageAuthenticatorTest(unittest.TestCase):
         m1 = MessageAuthenticator(key)
         assert m1.verify(a), "expected message to verify";
  
+    def testBufferInputs(self):
+        key = sha2(PairingGroup('SS512').random(GT))
+        m = MessageAuthenticator(key)
+        a = m.mac(bytearray(b'hello world'), associatedData=memoryview(b'header'))
+        assert a.digest == m.mac(b'hello world', associatedData='header').digest, "expected buffers to MAC like bytes"
+        wide = memoryview(array('i', [1, 2, 3]))
+        assert m.mac(wide).digest == m.mac(wide.tobytes()).digest, "expected a wide buffer to MAC as its bytes"
+
+    def testVerifyDict(self):
+        key = sha2(PairingGroup('SS512').random(GT))
+        m = MessageAuthenticator(key)
+        a = m.mac('hello world')
+        assert m.verify(a._asdict()), "expected message to verify";
+
     def testTamperData(self):
         key = sha2(PairingGroup('SS512').random(GT))
         m = MessageAuthenticator(key)
         a = m.mac('hello world')
         m1 = MessageAuthenticator(key)
-        a["msg"]= "tampered" 
+        a = a._replace(msg="tampered")
         assert not m1.verify(a), "expected message to verify";
 
     def testTamperMac(self):
@@ -91,7 +305,7 @@ class MessageAuthenticatorTest(unittest.TestCase):
         m = MessageAuthenticator(key)
         a = m.mac('hello world')
         m1 = MessageAuthenticator(key)
-        a["digest"]= "tampered" 
+        a = a._replace(digest="tampered")
         assert not m1.verify(a), "expected message to verify";
 
     def testTamperAlg(self):
@@ -100,7 +314,7 @@ class MessageAuthenticatorTest(unittest.TestCase):
         a = m.mac('hello world')
         m1 = MessageAuthenticator(key)
         m1._algorithm = "alg" # bypassing the algorithm check to verify the mac is over the alg + data 
-        a["alg"]= "alg" 
+        a = a._replace(alg="alg")
         assert not m1.verify(a), "expected message to verify";
 
 if __name__ == "__main__":
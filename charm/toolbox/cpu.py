@@ -0,0 +1,49 @@
+'''
+CPU feature detection, used to choose between symmetric primitives.
+'''
+import platform
+
+_unknown = object()
+_aesni = _unknown
+_aesni_extension = _unknown
+
+def has_aesni():
+    '''
+    Returns True if the CPU supports the AES-NI instructions. This is known either from a usable
+    charm.core.crypto._aesni_cbc extension or, failing that, from the flags in /proc/cpuinfo. The latter
+    only exists on Linux, so elsewhere (e.g. Windows, or macOS on x86) a build without the extension
+    reports False even on CPUs with AES-NI.
+    '''
+    global _aesni
+    if _aesni is _unknown:
+        _aesni = aesni_extension() is not None or _cpuinfo_has_aesni()
+    return _aesni
+
+def aesni_extension():
+    '''
+    Returns the charm.core.crypto._aesni_cbc module if it was built with its AES-NI code paths and the CPU
+    supports them, None otherwise.
+    '''
+    global _aesni_extension
+    if _aesni_extension is _unknown:
+        try:
+            from charm.core.crypto import _aesni_cbc
+        except ImportError:
+            _aesni_cbc = None
+        # has_aesni() is False both without CPU support and for builds without
+        # the AES-NI code paths (e.g. MSVC), so it only answers for this module
+        _aesni_extension = _aesni_cbc if _aesni_cbc is not None and _aesni_cbc.has_aesni() else None
+    return _aesni_extension
+
+def _cpuinfo_has_aesni():
+    if platform.machine().lower() not in ('x86_64', 'amd64', 'i386', 'i686', 'x86'):
+        return False
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return 'aes' in line.split(':', 1)[1].split()
+    except (IOError, OSError):
+        pass
+    # platform.processor() does not list CPU features, so assume no AES-NI
+    return False
@@ -1,10 +1,86 @@
-from charm.toolbox.paddingschemes import PKCS7Padding
 from charm.toolbox.securerandom import OpenSSLRand
+from charm.toolbox.cpu import has_aesni, aesni_extension
 from charm.core.crypto.cryptobase import MODE_CBC,AES,selectPRP
 from hashlib import sha256 as sha2
-import json
 import hmac
-from base64 import b64encode, b64decode
+import struct
+from collections import namedtuple
+from functools import partial
+try:
+    # orjson serializes straight to bytes and parses bytes or str
+    import orjson
+    _json_dumps = orjson.dumps
+    def _json_dumps_str(obj):
+        return orjson.dumps(obj).decode('utf-8')
+    def _json_loads(data):
+        # orjson rejects bytes subclasses, e.g. the bitstring.Bytes made by bytesToObject()
+        if isinstance(data, bytes) and type(data) is not bytes:
+            data = bytes(data)
+        return orjson.loads(data)
+except ImportError:
+    import json
+    def _json_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+    _json_dumps_str = json.dumps
+    _json_loads = json.loads
+try:
+    # SIMD-accelerated, drop-in replacement for the stdlib codec
+    from pybase64 import b64encode, b64decode
+except ImportError:
+    from base64 import b64encode, b64decode
+try:
+    # PyCryptodome's AES uses AES-NI when the CPU supports it
+    from Crypto.Cipher import AES as _PyCryptoAES
+except ImportError:
+    _PyCryptoAES = None
+try:
+    from Crypto.Cipher import ChaCha20_Poly1305 as _PyCryptoChaCha20Poly1305
+except ImportError:
+    _PyCryptoChaCha20Poly1305 = None
+# None unless the AES-NI CBC extension is usable on this CPU
+_aesni_cbc = aesni_extension()
+
+# binary envelope header: mode, IV, ciphertext length
+_ENVELOPE_HEADER = struct.Struct("<B16sI")
+# authenticated message produced by MessageAuthenticator.mac()
+AuthMsg = namedtuple("AuthMsg", "alg msg digest")
+
+def _asAuthMsg(msgAndDigest):
+    # accept the dictionaries produced by earlier versions or by deserialization
+    if isinstance(msgAndDigest, dict):
+        return AuthMsg(msgAndDigest['alg'], msgAndDigest['msg'], msgAndDigest['digest'])
+    return msgAndDigest
+
+# PKCS 7 padding for 16 byte blocks, _PKCS7_TABLE[n - 1] is n bytes of value n
+_PKCS7_TABLE = tuple(bytes([n]) * n for n in range(1, 17))
+
+def _toBytes(data):
+    # str is encoded; other buffers are used as is, viewed as unsigned bytes if their items are wider,
+    # since lengths (padding, PyCryptodome) are taken with len(), which counts items
+    if isinstance(data, str):
+        return data.encode("utf-8")
+    if isinstance(data, (bytes, bytearray)):
+        return data
+    return memoryview(data).cast('B')
+
+def _pkcs7_pad(message):
+    # message must be a byte buffer, see _toBytes()
+    return b"".join((message, _PKCS7_TABLE[15 - (len(message) & 15)]))
+
+def _pkcs7_unpad(msg):
+    # Branch-free check: all 16 trailing bytes are inspected whatever the pad value, and the
+    # result is combined with masks rather than an early exit. Invalid padding strips nothing;
+    # detecting tampering is the MAC's job (see AuthenticatedCryptoAbstraction), not the padding's.
+    if len(msg) < 16:
+        return msg
+    n = msg[-1]
+    # non-zero unless 1 <= n <= 16
+    bad = ((n - 1) >> 8) | ((16 - n) >> 8)
+    for j in range(1, 17):
+        # byte j from the end belongs to the pad iff j <= n
+        bad |= ((j - n - 1) >> 8) & (msg[-j] ^ n)
+    valid = (bad == 0)
+    return msg[:len(msg) - (n & -valid)]
 
 class MessageAuthenticator(object):
     """ Abstraction for constructing and verifying authenticated messages
@@ -31,6 +107,18 @@ class MessageAuthenticator(object):
             raise ValueError("Currently only HMAC_SHA2 is supported as an algorithm")
         self._algorithm = alg
         self._key = key
+        # keyed once, copied for every MAC instead of redoing the HMAC key setup
+        self._hmac_template = hmac.new(self._key, digestmod=sha2)
+
+    @property
+    def _algorithm(self):
+        return self.__algorithm
+
+    @_algorithm.setter
+    def _algorithm(self, alg):
+        # keep the encoded algorithm name in sync, it prefixes every MAC input
+        self.__algorithm = alg
+        self._alg_bytes = bytes(alg, "utf-8")
 
     def mac(self, msg, associatedData=b''):
         """
@@ -39,24 +127,32 @@ class MessageAuthenticator(object):
 
         Parameters
         ----------
-        msg : str or byte str
+        msg : str or bytes-like
             The message serving as input to the HMAC algorithm, in addition to the HMAC algorithm and associated data.
-        associatedData : str or byte str, optional
+        associatedData : str or bytes-like, optional
             Associated data that will be MACed together with the ciphertext and algorithm; the associated data will not be encrypted.
 
         Returns
         -------
-        dict
-            Dictionary composed of the MAC algorithm, the MACed message (or ciphertext), and the digest computed by MACing HMAC_algorithm + associatedData + msg.
+        AuthMsg
+            Named tuple composed of the MAC algorithm (alg), the MACed message or ciphertext (msg), and the digest computed by MACing
+            HMAC_algorithm + associatedData + msg (digest). Use _asdict() where a dictionary is needed.
         """
-        # Ensure the associated data is in byte format, convert if necessary.
-        if type(associatedData) != bytes :
-            associatedData = bytes(associatedData, "utf-8")
-        return {
-                "alg": self._algorithm,
-                "msg": msg,
-                "digest": hmac.new(self._key, bytes(self._algorithm, "utf-8") + associatedData + bytes(msg, "utf-8"), digestmod=sha2).hexdigest()
-               }
+        # Encode str inputs and view wider buffers as bytes; other bytes-like objects are fed to HMAC as is.
+        associatedData = _toBytes(associatedData)
+        msg_bytes = _toBytes(msg)
+        return AuthMsg(self._algorithm, msg, self._digest(msg_bytes, associatedData))
+
+    def _digest(self, msg, associatedData):
+        """
+        Computes the hex digest HMAC(key, algorithm + associatedData + msg) over already encoded inputs.
+        """
+        # HMAC is streaming, feed the parts separately rather than building their concatenation
+        h = self._hmac_template.copy()
+        h.update(self._alg_bytes)
+        h.update(associatedData)
+        h.update(msg)
+        return h.hexdigest()
 
     def verify(self, msgAndDigest, associatedData=b''):
         """
@@ -64,10 +160,10 @@ class MessageAuthenticator(object):
 
         Parameters
         ----------
-        msgAndDigest : dict
-            Dictionary composed of the MAC algorithm, the MACed message (or ciphertext), and the digest computed by MACing HMAC_algorithm + associatedData + msg.
-            It is the format generated by the mac() function within this class.
-        associatedData : str or byte str, optional
+        msgAndDigest : AuthMsg or dict
+            The MAC algorithm, the MACed message (or ciphertext), and the digest computed by MACing HMAC_algorithm + associatedData + msg.
+            It is the format generated by the mac() function within this class; the equivalent dictionary is accepted as well.
+        associatedData : str or bytes-like, optional
             Associated data that will be MACed together with the ciphertext and algorithm; the associated data will not be encrypted.
 
         Returns
@@ -80,12 +176,16 @@ class MessageAuthenticator(object):
         ValueError
             If the HMAC algorithm is not supported.
         """
-        if msgAndDigest['alg'] != self._algorithm:
+        msgAndDigest = _asAuthMsg(msgAndDigest)
+        if msgAndDigest.alg != self._algorithm:
             raise ValueError("Currently only HMAC_SHA2 is supported as an algorithm")
-        expected = bytes(self.mac(msgAndDigest['msg'], associatedData=associatedData)['digest'], 'utf-8')
-        received = bytes(msgAndDigest['digest'], 'utf-8')
-        # we compare the hash instead of the direct value to avoid a timing attack
-        return sha2(expected).digest() == sha2(received).digest()
+        associatedData = _toBytes(associatedData)
+        msg = msgAndDigest.msg
+        msg_bytes = _toBytes(msg)
+        expected = bytes(self._digest(msg_bytes, associatedData), 'utf-8')
+        received = bytes(msgAndDigest.digest, 'utf-8')
+        # constant-time comparison to avoid a timing attack
+        return hmac.compare_digest(expected, received)
 
 class SymmetricCryptoAbstraction(object):
     """
@@ -105,22 +205,47 @@ class SymmetricCryptoAbstraction(object):
     >>> ct = a.encrypt(b"Friendly Fire Isn't")
     >>> a.decrypt(ct)
     b"Friendly Fire Isn't"
+
+    With legacy=False the ciphertext is a compact binary envelope,
+    mode || IV || len(CipherText) || CipherText, instead of a JSON string.
+
+    >>> b = SymmetricCryptoAbstraction(extract_key(groupObj.random(GT)), legacy=False)
+    >>> ct = b.encrypt(b"Friendly Fire Isn't")
+    >>> type(ct)
+    <class 'bytes'>
+    >>> b.decrypt(ct)
+    b"Friendly Fire Isn't"
     """
 
-    def __init__(self, key, alg = AES, mode = MODE_CBC):
+    def __init__(self, key, alg = AES, mode = MODE_CBC, legacy = True):
         self._alg = alg
         self.key_len = 16
         self._block_size = 16
         self._mode = mode
         self._key = key[0:self.key_len] # expected to be bytes
         assert len(self._key) == self.key_len, "SymmetricCryptoAbstraction key too short"
-        self._padding = PKCS7Padding()
+        self._legacy = legacy
+        if alg == AES and mode == MODE_CBC and _PyCryptoAES is not None:
+            self._newCipher = partial(_PyCryptoAES.new, self._key, _PyCryptoAES.MODE_CBC)
+        else:
+            self._newCipher = self._selectPRP
+        if alg == AES and mode == MODE_CBC and _aesni_cbc is not None:
+            # interleaves the independent CBC block decryptions
+            self._cbcDecrypt = partial(_aesni_cbc.cbc_decrypt, self._key)
+            # interleaves independent messages, sharing one key expansion
+            self._cbcEncryptMany = partial(_aesni_cbc.cbc_encrypt_many, self._key)
+        else:
+            self._cbcDecrypt = None
+            self._cbcEncryptMany = None
+
+    def _selectPRP(self, IV):
+        return selectPRP(self._alg,(self._key,self._mode,IV))
 
     def _initCipher(self,IV = None):
         if IV == None :
             IV =  OpenSSLRand().getRandomBytes(self._block_size)
         self._IV = IV
-        return selectPRP(self._alg,(self._key,self._mode,self._IV))
+        return self._newCipher(self._IV)
 
     def __encode_decode(self,data,func):
         data['IV'] = func(data['IV'])
@@ -136,34 +261,96 @@ class SymmetricCryptoAbstraction(object):
     def _decode(self, data):
         return self.__encode_decode(data, lambda x: b64decode(bytes(x, 'utf-8')))
 
+    def _pack(self, data):
+        ct = data['CipherText']
+        return _ENVELOPE_HEADER.pack(data['MODE'], data['IV'], len(ct)) + ct
+
+    def _unpack(self, data):
+        if len(data) < _ENVELOPE_HEADER.size:
+            raise ValueError("Ciphertext envelope is truncated")
+        mode, IV, ct_len = _ENVELOPE_HEADER.unpack_from(data)
+        if mode != self._mode:
+            raise ValueError("Ciphertext was not produced with this cipher mode")
+        ct = data[_ENVELOPE_HEADER.size:]
+        if len(ct) != ct_len:
+            raise ValueError("Ciphertext envelope is truncated")
+        return {'ALG': self._alg, 'MODE': mode, 'IV': IV, 'CipherText': ct}
+
     def encrypt(self, message):
-        #This should be removed when all crypto functions deal with bytes"
-        if type(message) != bytes :
-            message = bytes(message, "utf-8")
-        ct = self._encrypt(message)
+        # legacy ciphertexts are JSON strings
+        return self._serialize(self._encrypt(message), _json_dumps_str)
+
+    def encrypt_many(self, messages):
+        """
+        Encrypts each message in messages under its own random IV. With AES-NI the key is expanded once
+        and up to 8 messages are encrypted in parallel; otherwise this is equivalent to calling encrypt()
+        on each message.
+
+        Parameters
+        ----------
+        messages : list of str or bytes-like
+            The messages to be encrypted.
+
+        Returns
+        -------
+        list
+            The ciphertexts, in the same order and format as returned by encrypt().
+        """
+        return self._encrypt_many(messages, _json_dumps_str)
+
+    def _encrypt_many(self, messages, dumps=_json_dumps):
+        # the envelopes of encrypt_many(), serialized as by _serialize()
+        if self._cbcEncryptMany is None:
+            return [self._serialize(self._encrypt(message), dumps) for message in messages]
+        padded = []
+        for message in messages:
+            message = _toBytes(message)
+            padded.append(_pkcs7_pad(message))
+        if not padded:
+            return []
+        rand = OpenSSLRand().getRandomBytes(self._block_size * len(padded))
+        ivs = [rand[i:i + self._block_size] for i in range(0, len(rand), self._block_size)]
+        cts = self._cbcEncryptMany(ivs, padded)
+        return [self._serialize({'ALG': self._alg, 'MODE': self._mode, 'IV': IV, 'CipherText': ct}, dumps)
+                for IV, ct in zip(ivs, cts)]
+
+    def _serialize(self, ct, dumps=_json_dumps):
+        # the binary envelope, or if legacy the JSON envelope as produced by dumps (bytes by default)
+        if not self._legacy:
+            return self._pack(ct)
         #JSON strings cannot have binary data in them, so we must base64 encode cipher
-        cte = json.dumps(self._encode(ct))
-        return cte
+        return dumps(self._encode(ct))
+
+    def _encrypt_bytes(self, message):
+        # same envelope as encrypt(), but always as a byte string
+        return self._serialize(self._encrypt(message))
 
     def _encrypt(self, message):
+        #This should be removed when all crypto functions deal with bytes"
+        message = _toBytes(message)
         #Because the IV cannot be set after instantiation, decrypt and encrypt
         # must operate on their own instances of the cipher
         cipher = self._initCipher()
         ct= {'ALG': self._alg,
             'MODE': self._mode,
             'IV': self._IV,
-            'CipherText': cipher.encrypt(self._padding.encode(message))
+            'CipherText': cipher.encrypt(_pkcs7_pad(message))
             }
         return ct
 
     def decrypt(self, cipherText):
-        f = json.loads(cipherText)
+        if not self._legacy:
+            return self._decrypt(self._unpack(cipherText))
+        f = _json_loads(cipherText)
         return self._decrypt(self._decode(f))
 
     def _decrypt(self, cipherText):
-        cipher = self._initCipher(cipherText['IV'])
-        msg = cipher.decrypt(cipherText['CipherText'])
-        return self._padding.decode(msg)
+        if self._cbcDecrypt is not None:
+            msg = self._cbcDecrypt(cipherText['IV'], cipherText['CipherText'])
+        else:
+            cipher = self._initCipher(cipherText['IV'])
+            msg = cipher.decrypt(cipherText['CipherText'])
+        return _pkcs7_unpad(msg)
 
 class AuthenticatedCryptoAbstraction(SymmetricCryptoAbstraction):
     """
@@ -200,6 +387,11 @@ class AuthenticatedCryptoAbstraction(SymmetricCryptoAbstraction):
     b'Some network PDU.'
     >>>
     """
+    def __init__(self, key, alg = AES, mode = MODE_CBC, legacy = True):
+        super(AuthenticatedCryptoAbstraction, self).__init__(key, alg, mode, legacy)
+        # warning only valid in the random oracle
+        self._mac = MessageAuthenticator(sha2(b'Poor Mans Key Extractor'+self._key).digest())
+
     def encrypt(self, msg, associatedData=''):
         """
         Encrypts a message in AEAD mode (Authenticated Encryption with Associated Data) using the superclass symmetric encryption parameters.
@@ -208,22 +400,23 @@ class AuthenticatedCryptoAbstraction(SymmetricCryptoAbstraction):
 
         Parameters
         ----------
-        msg : str or byte str
+        msg : str or bytes-like
             The message to be encrypted.
-        associatedData : str or byte str, optional
+        associatedData : str or bytes-like, optional
             Associated data that will be MACed together with the ciphertext and algorithm; the associated data will not be encrypted.
 
         Returns
         -------
-        dict
-            Dictionary structure containing:
+        AuthMsg
+            Named tuple containing:
                 msg: {'ALG': symmetric cryptosystem.
                       'MODE': symmetric encryption mode.
                       'IV': the IV for the encryption algorithm.
                       'CipherText': the padded ciphertext (padding according to PKCS 7).
                      }
-                "alg": The HMAC algorithm.
-                "digest": The MAC computed as MAC = HMAC(key, alg + associatedData + msg)
+                     serialized as a JSON byte string, or if legacy=False as the base64 encoded binary envelope of the superclass.
+                alg: The HMAC algorithm.
+                digest: The MAC computed as MAC = HMAC(key, alg + associatedData + msg)
 
         Notes
         -----
@@ -233,11 +426,32 @@ class AuthenticatedCryptoAbstraction(SymmetricCryptoAbstraction):
 
         The MAC key is computed as sha2(b'Poor Mans Key Extractor" + key).
         """
-        # warning only valid in the random oracle
-        mac_key = sha2(b'Poor Mans Key Extractor'+self._key).digest()
-        mac = MessageAuthenticator(mac_key)
-        enc = super(AuthenticatedCryptoAbstraction, self).encrypt(msg)
-        return mac.mac(enc, associatedData=associatedData)
+        # bytes envelope, so mac() does not have to encode it again
+        return self._authenticate(self._encrypt_bytes(msg), associatedData)
+
+    def encrypt_many(self, messages, associatedData=''):
+        """
+        Encrypts each message in messages as encrypt() does, using the batched encryption of the superclass.
+
+        Parameters
+        ----------
+        messages : list of str or bytes-like
+            The messages to be encrypted.
+        associatedData : str or bytes-like, optional
+            Associated data that will be MACed together with each ciphertext and algorithm; the associated data will not be encrypted.
+
+        Returns
+        -------
+        list of AuthMsg
+            The authenticated ciphertexts, in the same order and format as returned by encrypt().
+        """
+        return [self._authenticate(enc, associatedData) for enc in self._encrypt_many(messages)]
+
+    def _authenticate(self, enc, associatedData):
+        if not self._legacy:
+            # keep the binary envelope text-safe, as the JSON one is, e.g. for objectToBytes()
+            enc = b64encode(enc)
+        return self._mac.mac(enc, associatedData=associatedData)
 
     def decrypt(self, cipherText, associatedData=''):
         """
@@ -247,9 +461,9 @@ class AuthenticatedCryptoAbstraction(SymmetricCryptoAbstraction):
 
         Parameters
         ----------
-        ciphertext : str or byte str
-            The message to be decrypted.
-        associatedData : str or byte str, optional
+        ciphertext : AuthMsg or dict
+            The message to be decrypted, as returned by encrypt().
+        associatedData : str or bytes-like, optional
             Associated data that will be MACed together with the ciphertext and algorithm. This associated text must be in plaintext.
 
         Returns
@@ -270,10 +484,166 @@ class AuthenticatedCryptoAbstraction(SymmetricCryptoAbstraction):
 
         The MAC key is computed as sha2(b'Poor Mans Key Extractor" + key).
         """
-        # warning only valid in the random oracle
-        mac_key = sha2(b'Poor Mans Key Extractor'+self._key).digest()
-        mac = MessageAuthenticator(mac_key)
-        if not mac.verify(cipherText, associatedData=associatedData):
+        if not self._mac.verify(cipherText, associatedData=associatedData):
             raise ValueError("Invalid mac. Your data was tampered with or your key is wrong")
         else:
-            return super(AuthenticatedCryptoAbstraction, self).decrypt(cipherText['msg'])
+            enc = _asAuthMsg(cipherText).msg
+            if not self._legacy:
+                enc = b64decode(enc)
+            return super(AuthenticatedCryptoAbstraction, self).decrypt(enc)
+
+class _AEADCipherAbstraction(object):
+    """
+    Base class for one-pass AEAD ciphers whose ciphertext is the byte string id || nonce || tag || ciphertext,
+    where id is a single byte naming the cipher. It is not usable on its own: subclasses set _alg_id and key_len,
+    and define _initCipher(nonce), which returns a fresh PyCryptodome AEAD cipher object for the nonce.
+    """
+    _alg_id = None
+    key_len = 16
+    _nonce_len = 12
+    _tag_len = 16
+
+    def __init__(self, key):
+        if self._alg_id is None:
+            raise TypeError("_AEADCipherAbstraction is a base class, use AESGCMCryptoAbstraction or ChaCha20Poly1305CryptoAbstraction")
+        self._key = key[0:self.key_len] # expected to be bytes
+        assert len(self._key) == self.key_len, "%s key too short" % type(self).__name__
+
+    def encrypt(self, msg, associatedData=''):
+        """
+        Encrypts and authenticates a message, authenticating the associated data along with it.
+
+        Parameters
+        ----------
+        msg : str or bytes-like
+            The message to be encrypted.
+        associatedData : str or bytes-like, optional
+            Associated data that will be authenticated together with the ciphertext; the associated data will not be encrypted.
+
+        Returns
+        -------
+        byte str
+            id || nonce || tag || ciphertext
+        """
+        msg = _toBytes(msg)
+        associatedData = _toBytes(associatedData)
+        nonce = OpenSSLRand().getRandomBytes(self._nonce_len)
+        cipher = self._initCipher(nonce)
+        cipher.update(associatedData)
+        ct, tag = cipher.encrypt_and_digest(msg)
+        return b"".join((self._alg_id, nonce, tag, ct))
+
+    def decrypt(self, cipherText, associatedData=''):
+        """
+        Decrypts a ciphertext produced by encrypt(), after verifying its tag over the ciphertext and associated data.
+
+        Parameters
+        ----------
+        cipherText : byte str
+            id || nonce || tag || ciphertext, as returned by encrypt().
+        associatedData : str or bytes-like, optional
+            Associated data that was authenticated together with the ciphertext.
+
+        Returns
+        -------
+        byte str
+            The decrypted plaintext.
+
+        Raises
+        ------
+        ValueError
+            If the ciphertext was produced by another cipher, or if the tag is invalid.
+        """
+        associatedData = _toBytes(associatedData)
+        if bytes(cipherText[:1]) != self._alg_id:
+            raise ValueError("Ciphertext was not produced with %s" % type(self).__name__)
+        nonce_end = 1 + self._nonce_len
+        header_len = nonce_end + self._tag_len
+        if len(cipherText) < header_len:
+            raise ValueError("Invalid mac. Your data was tampered with or your key is wrong")
+        cipher = self._initCipher(cipherText[1:nonce_end])
+        cipher.update(associatedData)
+        try:
+            return cipher.decrypt_and_verify(cipherText[header_len:], cipherText[nonce_end:header_len])
+        except ValueError:
+            raise ValueError("Invalid mac. Your data was tampered with or your key is wrong")
+
+class AESGCMCryptoAbstraction(_AEADCipherAbstraction):
+    """
+    Authenticated Encryption with Associated Data (AEAD) using AES-GCM, which encrypts and authenticates in a single pass.
+    Requires PyCryptodome, whose GCM implementation uses AES-NI and carry-less multiplication where available.
+
+    The ciphertext is the byte string id || nonce || tag || ciphertext, where the id byte is 0x01. As with AuthenticatedCryptoAbstraction, the associated data is
+    authenticated but neither encrypted nor saved within the ciphertext.
+
+    PyCryptodome is optional, hence its usage is shown in the unit tests rather than as doctests.
+    """
+    _alg_id = b'\x01'
+
+    def __init__(self, key):
+        if _PyCryptoAES is None:
+            raise ImportError("AESGCMCryptoAbstraction requires PyCryptodome")
+        super(AESGCMCryptoAbstraction, self).__init__(key)
+
+    def _initCipher(self, nonce):
+        return _PyCryptoAES.new(self._key, _PyCryptoAES.MODE_GCM, nonce=nonce, mac_len=self._tag_len)
+
+class ChaCha20Poly1305CryptoAbstraction(_AEADCipherAbstraction):
+    """
+    Authenticated Encryption with Associated Data (AEAD) using ChaCha20-Poly1305 (RFC 7539), for CPUs without AES-NI where
+    software AES is slow and prone to cache-timing leaks. ChaCha20 is constant time by construction. Requires PyCryptodome.
+
+    The API and the ciphertext layout, id || nonce || tag || ciphertext, are those of AESGCMCryptoAbstraction, but the id byte is 0x02
+    and the key is 32 bytes long.
+    """
+    _alg_id = b'\x02'
+    key_len = 32
+
+    def __init__(self, key):
+        if _PyCryptoChaCha20Poly1305 is None:
+            raise ImportError("ChaCha20Poly1305CryptoAbstraction requires PyCryptodome")
+        super(ChaCha20Poly1305CryptoAbstraction, self).__init__(key)
+
+    def _initCipher(self, nonce):
+        return _PyCryptoChaCha20Poly1305.new(key=self._key, nonce=nonce)
+
+_AEAD_CIPHERS = {
+    AESGCMCryptoAbstraction._alg_id: AESGCMCryptoAbstraction,
+    ChaCha20Poly1305CryptoAbstraction._alg_id: ChaCha20Poly1305CryptoAbstraction,
+}
+
+class _SelectedAEADCryptoAbstraction(object):
+    """
+    Encrypts with the cipher picked for this CPU, and decrypts with whichever cipher the id byte of the ciphertext names.
+    The key must be long enough for either cipher, i.e. at least 32 bytes, whichever cipher this host picks.
+    Each cipher is keyed with its own subkey, sha2(b'selectAEAD' + id + key).
+    """
+    def __init__(self, key):
+        if len(key) < ChaCha20Poly1305CryptoAbstraction.key_len:
+            raise ValueError("selectAEAD requires a key of at least %d bytes" % ChaCha20Poly1305CryptoAbstraction.key_len)
+        self._key = key
+        self._ciphers = {}
+        self._encryptor = self._cipher(AESGCMCryptoAbstraction._alg_id if has_aesni() else ChaCha20Poly1305CryptoAbstraction._alg_id)
+
+    def _cipher(self, alg_id):
+        if alg_id not in self._ciphers:
+            # as for the MAC key of AuthenticatedCryptoAbstraction, do not share the raw key between ciphers
+            self._ciphers[alg_id] = _AEAD_CIPHERS[alg_id](sha2(b'selectAEAD' + alg_id + self._key).digest())
+        return self._ciphers[alg_id]
+
+    def encrypt(self, msg, associatedData=''):
+        return self._encryptor.encrypt(msg, associatedData=associatedData)
+
+    def decrypt(self, cipherText, associatedData=''):
+        alg_id = bytes(cipherText[:1])
+        if alg_id not in _AEAD_CIPHERS:
+            raise ValueError("Unknown AEAD cipher identifier")
+        return self._cipher(alg_id).decrypt(cipherText, associatedData=associatedData)
+
+def selectAEAD(key):
+    """
+    Returns an AEAD abstraction that encrypts with AES-GCM on CPUs with AES-NI and with ChaCha20-Poly1305 otherwise.
+    Ciphertexts start with a byte naming their cipher, so decryption works whichever cipher the encrypting host chose.
+    Both ciphers require PyCryptodome, and the key must be at least 32 bytes long.
+    """
+    return _SelectedAEADCryptoAbstraction(key)
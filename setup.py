@@ -235,7 +235,11 @@ des3  = Extension(crypto_prefix + '.DES3',
                                     crypto_path + 'DES/'], 
                     sources = [crypto_path + 'DES3/DES3.c'])
 
-_ext_modules.extend([benchmark_module, cryptobase, aes, des, des3])
+# AES-NI code paths are enabled per function and checked at runtime
+aesni_cbc = Extension(crypto_prefix + '._aesni_cbc',
+                    sources = [crypto_path + 'AESNI/_aesni_cbc.c'])
+
+_ext_modules.extend([benchmark_module, cryptobase, aes, des, des3, aesni_cbc])
 #_ext_modules.extend([cryptobase, aes, des, des3])
 
 if platform.system() in ['Linux', 'Windows']: